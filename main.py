@@ -1,31 +1,253 @@
 import os
+import base64
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import numpy as np
+import plotly
 import pandas as pd
 import plotly.express as px
 import plotly.io as pio
 import plotly.graph_objects as go
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, stream_template, request, jsonify
+from flask_caching import Cache
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
 
 app = Flask(__name__)
 
+# Rendered plot divs are memoized per file and modification time, so entries never go stale.
+# Set CACHE_TYPE=RedisCache and CACHE_REDIS_URL to share the cache between workers.
+cache = Cache(app, config={
+    'CACHE_TYPE': os.environ.get('CACHE_TYPE', 'FileSystemCache'),
+    'CACHE_DIR': '.plotcache',
+    'CACHE_REDIS_URL': os.environ.get('CACHE_REDIS_URL'),
+    'CACHE_DEFAULT_TIMEOUT': 0
+})
+
+def _code_version():
+    """Hash of this module's source and the plotly version"""
+    with open(__file__, 'rb') as f:
+        digest = hashlib.sha256(f.read())
+    digest.update(plotly.__version__.encode())
+    return digest.hexdigest()[:12]
+
+# Part of every cache key, so plots cached by a different version of the plotting code
+# or its settings are never served
+CODE_VERSION = _code_version()
+
+def _versioned_name(fname):
+    """Name memoized functions by their name and CODE_VERSION"""
+    return f"{fname}-{CODE_VERSION}"
+
 # Configuration
 CSV_FOLDER = 'csvs'
+MAX_WORKERS = 8
+# pyarrow parses CSVs multi-threaded and enables the Parquet copies;
+# without it, fall back to pandas' C parser and plain CSV reads
+CSV_ENGINE = 'pyarrow' if pq else 'c'
+# Longer series are downsampled with LTTB before plotting: points per time series trace,
+# and points per file in the parametric and comparison plots
+TIME_SERIES_POINTS = 2000
+PARAMETRIC_POINTS = 1000
+# Time series variables shown when the page loads; the rest start hidden in the legend
+VISIBLE_BY_DEFAULT = frozenset({'profit_share', 'utilization_rate', 'consumption_rate',
+                                'investment_rate', 'H_stock'})
 COLUMNS_TO_IGNORE = ['X_center', 'X_cycle_time', 'X_continuous_level', 'X_cycle_time', 'X_n_steps', 'X_phase', 'X_step_duration', 'X_step_index', 'X_step_progress', 'X_triangle', 'X_within_step']
 
-def get_available_csv_files():
-    """Get list of available CSV files"""
-    csv_files = []
-    if os.path.exists(CSV_FOLDER):
-        csv_files = [f for f in os.listdir(CSV_FOLDER) if f.endswith('.csv')]
-    return sorted(csv_files)
+# Same hover labels as the Plotly Express line plot this replaced
+TIME_SERIES_HOVER = 'variable=%{fullData.name}<br>Time=%{x}<br>Value=%{y}<extra></extra>'
+# Plot layouts, built once and passed whole when a figure is created
+TIME_SERIES_LAYOUT = dict(
+    xaxis=dict(title=dict(text='Time')),
+    yaxis=dict(title=dict(text='Value')),
+    legend=dict(title=dict(text='Variables')),
+    hovermode='x unified',
+    showlegend=True
+)
+COMPARISON_LAYOUT = dict(
+    title=dict(text="Parametric Comparison: Profit Share vs Utilization Rate"),
+    xaxis=dict(title=dict(text='Profit Share')),
+    yaxis=dict(title=dict(text='Utilization Rate')),
+    height=500,
+    template=pio.templates[pio.templates.default].to_plotly_json()
+)
+
+# Shared by all requests, so plots keep rendering while a page is being streamed
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+# Plotly Express reads the shared default template, whose child objects are created lazily
+# on first access; concurrent first reads race, so px figures are built one at a time
+px_lock = threading.Lock()
 
-def create_time_series_plot(csv_path, filename):
+def scan_csv_files():
     """
-    Create the original time series plot
+    Get the directory entries of the available CSV files, sorted by name.
+    Entries carry the full path and cache their stat result, saving syscalls per file
     """
-    try:
-        # Read CSV file
-        df = pd.read_csv(csv_path)
+    if not os.path.exists(CSV_FOLDER):
+        return []
+    
+    with os.scandir(CSV_FOLDER) as it:
+        entries = [entry for entry in it if entry.name.endswith('.csv')]
+    return sorted(entries, key=lambda entry: entry.name)
+
+def _parquet_path(csv_path):
+    """Path of the Parquet copy kept next to a CSV file"""
+    return os.path.splitext(csv_path)[0] + '.parquet'
+
+def _source_stamp(csv_path):
+    """Modification time and size of a CSV file, as stored in its Parquet copy's metadata"""
+    stat = os.stat(csv_path)
+    return {b'source_mtime_ns': str(stat.st_mtime_ns).encode(), b'source_size': str(stat.st_size).encode()}
+
+def _has_fresh_parquet(csv_path):
+    """
+    Whether the Parquet copy of a CSV exists and was written from the CSV as it is now.
+    Compares the stored source mtime and size exactly rather than checking which file is
+    newer, since copies made with cp -p or rsync -a can carry an older mtime
+    """
+    parquet_path = _parquet_path(csv_path)
+    if pq is None or not os.path.exists(parquet_path):
+        return False
+    
+    metadata = pq.read_schema(parquet_path).metadata or {}
+    stamp = _source_stamp(csv_path)
+    return all(metadata.get(key) == value for key, value in stamp.items())
+
+def convert_csvs_to_parquet():
+    """
+    Write a zstd-compressed Parquet copy of every CSV file that lacks an up-to-date one,
+    so later loads skip text parsing. Does nothing when pyarrow is not installed
+    """
+    if pq is None:
+        return
+    
+    for entry in scan_csv_files():
+        if _has_fresh_parquet(entry.path):
+            continue
+        
+        try:
+            # Stamp before reading, so a CSV changed mid-conversion is converted again next time
+            stamp = _source_stamp(entry.path)
+            table = pa.Table.from_pandas(pd.read_csv(entry.path, engine=CSV_ENGINE))
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}), **stamp})
+            pq.write_table(table, _parquet_path(entry.path), compression='zstd')
+            print(f"Converted {entry.name} to Parquet")
+        except Exception as e:
+            print(f"Error converting {entry.name} to Parquet: {str(e)}")
+
+@lru_cache(maxsize=64)
+def _load(csv_path, mtime_ns):
+    """Parse a CSV file, or its Parquet copy when fresh; mtime_ns is only part of the cache key"""
+    # Skip the ignored columns at read time instead of filtering them afterwards
+    if _has_fresh_parquet(csv_path):
+        parquet_path = _parquet_path(csv_path)
+        columns = [col for col in pq.read_schema(parquet_path).names if col not in COLUMNS_TO_IGNORE]
+        df = pd.read_parquet(parquet_path, columns=columns)
+    else:
+        # The pyarrow engine needs usecols as a list, so read the header row first
+        header = pd.read_csv(csv_path, nrows=0).columns
+        usecols = [col for col in header if col not in COLUMNS_TO_IGNORE]
+        df = pd.read_csv(csv_path, usecols=usecols, engine=CSV_ENGINE)
+    
+    # float32 is plenty for plotted values and halves the data embedded in every plot.
+    # time keeps full precision, so long or offset time axes do not merge distinct points
+    float_cols = df.select_dtypes('float64').columns.drop('time', errors='ignore')
+    df[float_cols] = df[float_cols].astype('float32')
+    return df
+
+def load_csv(csv_path):
+    """
+    Load a CSV file as a DataFrame, reusing the parsed result until the file changes.
+    The returned DataFrame is shared between callers and must not be modified in place.
+    """
+    return _load(csv_path, os.stat(csv_path).st_mtime_ns)
+
+def lttb_indices(x, y, n_out):
+    """
+    Pick n_out row indices with Largest-Triangle-Three-Buckets downsampling.
+    The first and last points are always kept; every bucket in between keeps the point
+    forming the largest triangle with the last kept point and the next bucket's average.
+    Non-finite points are never chosen over finite ones nor used as the anchor; a bucket
+    with no finite point keeps its first point, so the gap still shows in the plot
+    """
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    finite = np.isfinite(x) & np.isfinite(y)
+    if not finite.any():
+        return np.linspace(0, n - 1, n_out).astype(np.intp)
+    
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)
+    indices = np.empty(n_out, dtype=np.intp)
+    indices[0] = 0
+    indices[-1] = n - 1
+    
+    a = int(np.argmax(finite))
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_bucket = slice(end, edges[i + 2]) if i + 2 < len(edges) else slice(n - 1, n)
+        next_finite = finite[next_bucket]
+        if next_finite.any():
+            next_x = x[next_bucket][next_finite].mean()
+            next_y = y[next_bucket][next_finite].mean()
+        else:
+            next_x, next_y = x[a], y[a]
+        
+        bucket_finite = finite[start:end]
+        if not bucket_finite.any():
+            indices[i + 1] = start
+            continue
         
+        areas = np.abs((x[a] - next_x) * (y[start:end] - y[a])
+                       - (x[a] - x[start:end]) * (next_y - y[a]))
+        areas[~bucket_finite] = -1
+        a = start + int(np.argmax(areas))
+        indices[i + 1] = a
+    
+    return indices
+
+def _is_numeric(series):
+    """Whether LTTB can run on a column: numeric, but not boolean"""
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+def _lttb_x(df):
+    """x values for LTTB: the time column when it is numeric, otherwise row positions"""
+    if 'time' in df.columns and _is_numeric(df['time']):
+        return df['time'].to_numpy('float64')
+    return np.arange(len(df), dtype='float64')
+
+def downsample(df, columns, n_out):
+    """
+    Reduce df to at most n_out rows with LTTB against the time column, for plots whose
+    columns must stay aligned row by row. The point budget is split evenly between the
+    numeric columns and the rows kept for any of them are kept for all; when none of
+    the columns is numeric, df is returned unchanged
+    """
+    numeric_cols = [col for col in columns if _is_numeric(df[col])]
+    if len(df) <= n_out or not numeric_cols:
+        return df
+    
+    x = _lttb_x(df)
+    n_per_column = n_out // len(numeric_cols)
+    keep = np.unique(np.concatenate([lttb_indices(x, df[col].to_numpy('float64'), n_per_column)
+                                     for col in numeric_cols]))
+    return df.iloc[keep]
+
+def create_time_series_plot(df, filename):
+    """
+    Create the original time series plot from a loaded CSV file
+    Errors are reported and re-raised
+    """
+    try:
         # Validate required columns
         if 'time' not in df.columns:
             print(f"Warning: 'time' column not found in {filename}")
@@ -40,58 +262,62 @@ def create_time_series_plot(csv_path, filename):
             print(f"No plottable columns found in {filename} after filtering")
             return None
         
-        # Melt dataframe to long format for Plotly Express
-        df_long = df.melt(id_vars=['time'], value_vars=value_vars, 
-                         var_name='variable', value_name='value')
+        # Split the variables once: the ones in VISIBLE_BY_DEFAULT come first in the
+        # legend and are shown, the rest start hidden and are toggled from the legend
+        visible_cols = [col for col in value_vars if col in VISIBLE_BY_DEFAULT]
+        hidden_cols = [col for col in value_vars if col not in VISIBLE_BY_DEFAULT]
         
-        # Create interactive line plot
-        fig = px.line(df_long, x='time', y='value', color='variable',
-                     title=f"{filename} - Time Series",
-                     labels={'value': 'Value', 'time': 'Time'})
+        # Create interactive line plot with one trace per column of the wide dataframe,
+        # without reshaping it to long format as Plotly Express would. Each numeric trace
+        # is downsampled with LTTB on its own, keeping at most TIME_SERIES_POINTS points;
+        # other columns are plotted in full.
+        # Like Plotly Express, switch to WebGL when the long-format frame would exceed 1000 rows
+        x = df['time'].to_numpy()
+        lttb_x = _lttb_x(df)
+        scatter = go.Scattergl if len(df) * len(value_vars) > 1000 else go.Scatter
+        traces = []
+        for cols, visible in ((visible_cols, True), (hidden_cols, 'legendonly')):
+            for col in cols:
+                y = df[col].to_numpy()
+                if _is_numeric(df[col]):
+                    keep = lttb_indices(lttb_x, y, TIME_SERIES_POINTS)
+                    x_col, y = x[keep], y[keep]
+                else:
+                    x_col = x
+                traces.append(scatter(x=x_col, y=y, mode='lines', name=col, visible=visible,
+                                      hovertemplate=TIME_SERIES_HOVER))
         
-        # Customize legend and layout
-        fig.update_layout(
-            xaxis_title='Time',
-            yaxis_title='Value',
-            legend_title='Variables',
-            hovermode='x unified',
-            showlegend=True
-        )
-
-        visible_by_default = ['profit_share', 'utilization_rate', 'consumption_rate', 
-                             'investment_rate', 'H_stock']
-
-        for trace in fig.data:
-            if hasattr(trace, 'name') and trace.name not in visible_by_default:
-                trace.visible = 'legendonly'
+        fig = go.Figure(traces, layout=dict(TIME_SERIES_LAYOUT, title=dict(text=f"{filename} - Time Series")))
         
-        # Convert to HTML div
-        return pio.to_html(fig, full_html=False)
+        # Convert to HTML div; plotly.js itself is loaded once by the page template
+        return pio.to_html(fig, full_html=False, include_plotlyjs=False,
+                           div_id=f"time-series-{filename}")
         
     except Exception as e:
         print(f"Error processing {filename}: {str(e)}")
-        return None
+        raise
 
-def create_parametric_plot(csv_path, filename):
+def create_parametric_plot(df, filename):
     """
-    Create parametric plot with profit_share vs utilization_rate
+    Create parametric plot with profit_share vs utilization_rate from a loaded CSV file
+    Errors are reported and re-raised
     """
     try:
-        # Read CSV file
-        df = pd.read_csv(csv_path)
-        
         # Check if required columns exist
         if 'profit_share' not in df.columns or 'utilization_rate' not in df.columns:
             print(f"Warning: Required columns 'profit_share' or 'utilization_rate' not found in {filename}")
             return None
         
+        df = downsample(df, ['profit_share', 'utilization_rate'], PARAMETRIC_POINTS)
+        
         # Create parametric scatter plot
-        fig = px.scatter(df, x='profit_share', y='utilization_rate',
-                        title=f"{filename} - Parametric Plot",
-                        labels={'profit_share': 'Profit Share', 'utilization_rate': 'Utilization Rate'})
+        with px_lock:
+            fig = px.scatter(df, x='profit_share', y='utilization_rate',
+                            title=f"{filename} - Parametric Plot",
+                            labels={'profit_share': 'Profit Share', 'utilization_rate': 'Utilization Rate'})
         
         # Optional: Add a line to connect the points in order
-        fig.add_scatter(x=df['profit_share'], y=df['utilization_rate'], 
+        fig.add_scatter(x=df['profit_share'].to_numpy(), y=df['utilization_rate'].to_numpy(), 
                        mode='lines', line=dict(dash='dot', color='gray'),
                        name='trend', showlegend=False)
         
@@ -102,17 +328,73 @@ def create_parametric_plot(csv_path, filename):
             showlegend=False
         )
         
-        # Convert to HTML div
-        return pio.to_html(fig, full_html=False)
+        # Convert to HTML div; plotly.js itself is loaded once by the page template
+        return pio.to_html(fig, full_html=False, include_plotlyjs=False,
+                           div_id=f"parametric-{filename}")
         
     except Exception as e:
         print(f"Error creating parametric plot for {filename}: {str(e)}")
+        raise
+
+def _render_file_plot(plot_function, csv_path, filename):
+    """Read a CSV file and render one of its plots, returning None on errors"""
+    try:
+        # Read CSV file; parsed frames are shared by both plots of a file
+        df = load_csv(csv_path)
+    except Exception as e:
+        print(f"Error reading {filename}: {str(e)}")
+        return None
+    
+    try:
+        return plot_function(df, filename)
+    except Exception:
+        # Already reported by the failing plot function
+        return None
+
+@cache.memoize(make_name=_versioned_name)
+def cached_time_series_plot(csv_path, filename, mtime_ns):
+    """
+    Create the time series plot for a CSV file
+    mtime_ns is the file modification time, used as part of the cache key
+    Returns None on errors: Flask-Caching does not store None, so a failed plot is retried
+    on the next page load while the file's other plot stays cached
+    """
+    return _render_file_plot(create_time_series_plot, csv_path, filename)
+
+@cache.memoize(make_name=_versioned_name)
+def cached_parametric_plot(csv_path, filename, mtime_ns):
+    """
+    Create the parametric plot for a CSV file
+    mtime_ns is the file modification time, used as part of the cache key
+    Returns None on errors, which are retried on the next page load like the time series
+    """
+    return _render_file_plot(create_parametric_plot, csv_path, filename)
+
+def create_file_plots(csv_path, filename, mtime_ns):
+    """
+    Create both the time series and the parametric plot for a CSV file, reading it once.
+    Each plot is cached on its own, so a failing plot does not hide the other one
+    """
+    return (cached_time_series_plot(csv_path, filename, mtime_ns),
+            cached_parametric_plot(csv_path, filename, mtime_ns))
+
+def _typed_array(values):
+    """Encode a float32 array as a plotly.js typed array, much smaller than a JSON list"""
+    return {'dtype': 'f4', 'bdata': base64.b64encode(values).decode('ascii')}
+
+def _mtime_ns(path):
+    """File modification time in nanoseconds, or None if the path cannot be stat-ed"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except (OSError, ValueError):
         return None
 
-def create_comparison_plot(selected_files):
+@cache.memoize(make_name=_versioned_name)
+def create_comparison_plot(selected_files, mtimes):
     """
     Create a comparison plot with multiple CSV files
     Each curve is colored based on the selection order
+    mtimes holds the files' modification times, used as part of the cache key
     """
     try:
         print(f"Creating comparison plot for files: {selected_files}")
@@ -120,7 +402,9 @@ def create_comparison_plot(selected_files):
         # Define colors for different files
         colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd']
         
-        fig = go.Figure()
+        # Traces are plain dicts: building go.Scatter objects would run
+        # Plotly's validators on every request for no benefit
+        traces = []
         valid_files_count = 0
         
         for i, filename in enumerate(selected_files):
@@ -130,7 +414,7 @@ def create_comparison_plot(selected_files):
                 print(f"File not found: {csv_path}")
                 continue
                 
-            df = pd.read_csv(csv_path)
+            df = load_csv(csv_path)
             print(f"Processing {filename}")
             
             # Check if required columns exist
@@ -138,12 +422,15 @@ def create_comparison_plot(selected_files):
                 print(f"Missing required columns in {filename}")
                 continue
             
+            df = downsample(df, ['profit_share', 'utilization_rate'], PARAMETRIC_POINTS)
+            
             color = colors[i % len(colors)]
             
             # Add scatter with lines
-            fig.add_trace(go.Scatter(
-                x=df['profit_share'],
-                y=df['utilization_rate'],
+            traces.append(dict(
+                type='scatter',
+                x=_typed_array(df['profit_share'].to_numpy('float32')),
+                y=_typed_array(df['utilization_rate'].to_numpy('float32')),
                 mode='lines+markers',
                 name=filename,
                 line=dict(color=color, width=3),
@@ -157,50 +444,57 @@ def create_comparison_plot(selected_files):
         if valid_files_count == 0:
             return None
         
-        fig.update_layout(
-            title="Parametric Comparison: Profit Share vs Utilization Rate",
-            xaxis_title='Profit Share',
-            yaxis_title='Utilization Rate',
-            height=500
-        )
-        
-        # Convert to JSON for client-side rendering
-        return fig.to_json()
+        # Convert to JSON for client-side rendering (uses orjson when it is installed)
+        return pio.to_json({'data': traces, 'layout': COMPARISON_LAYOUT}, validate=False)
         
     except Exception as e:
         print(f"Error creating comparison plot: {str(e)}")
         return None
 
+def _process_file(entry):
+    """
+    Create both plots for a single CSV file, given its directory entry.
+    Never raises: the page is already streaming, so an error would cut it off mid-HTML
+    """
+    try:
+        time_series_html, parametric_html = create_file_plots(entry.path, entry.name,
+                                                              entry.stat().st_mtime_ns)
+    except Exception as e:
+        print(f"Error processing {entry.name}: {str(e)}")
+        time_series_html, parametric_html = None, None
+    
+    return entry.name, time_series_html, parametric_html
+
+def build_all_plots(entries):
+    """
+    Create the plots for every CSV file entry in parallel.
+    Returns an iterator of (filename, time_series_html, parametric_html) in the order given,
+    yielding each file as soon as it and the ones before it are ready
+    """
+    return executor.map(_process_file, entries)
+
+def precompute_plots():
+    """
+    Render every plot into the cache at startup, so page loads only look them up.
+    Plots are cached per modification time, so an edited CSV is re-rendered on the next load
+    """
+    list(build_all_plots(scan_csv_files()))
+
 @app.route('/')
 def index():
     """Main dashboard route"""
-    time_series_plots = []
-    parametric_plots = []
-    filenames = []
-    
-    # Process all CSV files in the csvs folder
-    if os.path.exists(CSV_FOLDER):
-        for filename in os.listdir(CSV_FOLDER):
-            if filename.endswith('.csv'):
-                csv_path = os.path.join(CSV_FOLDER, filename)
-                
-                # Create both types of plots
-                time_series_html = create_time_series_plot(csv_path, filename)
-                parametric_html = create_parametric_plot(csv_path, filename)
-                
-                if time_series_html or parametric_html:
-                    time_series_plots.append(time_series_html)
-                    parametric_plots.append(parametric_html)
-                    filenames.append(filename)
+    # Process all CSV files in the csvs folder; the page is streamed, so the
+    # browser receives each file's plots while later files are still rendering
+    entries = scan_csv_files()
+    csv_files = [entry.name for entry in entries]
+    plots = ((filename, time_series_html, parametric_html)
+             for filename, time_series_html, parametric_html in build_all_plots(entries)
+             if time_series_html or parametric_html)
     
-    csv_files = get_available_csv_files()
-    
-    return render_template('index.html', 
-                         time_series_plots=time_series_plots,
-                         parametric_plots=parametric_plots,
-                         filenames=filenames,
+    return stream_template('index.html', 
+                         plots=plots,
                          csv_files=csv_files,
-                         plot_count=len(filenames))
+                         file_count=len(csv_files))
 
 @app.route('/compare', methods=['POST'])
 def compare_files():
@@ -211,7 +505,13 @@ def compare_files():
     if len(selected_files) < 2:
         return jsonify({'error': 'Please select at least 2 files'}), 400
     
-    comparison_plot = create_comparison_plot(selected_files)
+    if not all(isinstance(filename, str) for filename in selected_files):
+        return jsonify({'error': 'File names must be strings'}), 400
+    
+    # Repeated selections are served from the cache until one of the files changes
+    selected_files = tuple(selected_files)
+    mtimes = tuple(_mtime_ns(os.path.join(CSV_FOLDER, filename)) for filename in selected_files)
+    comparison_plot = create_comparison_plot(selected_files, mtimes)
     
     if comparison_plot:
         return jsonify({'plot_html': comparison_plot})
@@ -219,4 +519,9 @@ def compare_files():
         return jsonify({'error': 'Could not create comparison plot. Check if selected files have required columns.'}), 400
 
 if __name__ == '__main__':
+    # In debug mode the reloader runs this script twice: once to watch for code changes
+    # and once, with WERKZEUG_RUN_MAIN set, to serve. Only the serving process warms up
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        convert_csvs_to_parquet()
+        precompute_plots()
     app.run(debug=True)